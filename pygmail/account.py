@@ -1,6 +1,6 @@
 import mailbox
 import pygmail.errors
-from pygmail.utilities import extract_data, extract_type, _cmd_cb, _cmd
+from pygmail.utilities import extract_data, extract_type, quote, _cmd_cb, _cmd_cb_direct, _cmd
 from pygmail.errors import is_auth_error, AuthError, check_for_response_error, is_imap_error, IMAPError
 
 
@@ -99,7 +99,7 @@ class Account(object):
                 return _cmd_cb(connection.create, _on_mailbox_creation,
                                bool(callback), name)
 
-        return _cmd_cb(self.connection, _on_connection, bool(callback))
+        return _cmd_cb_direct(self.connection, _on_connection, bool(callback))
 
     def all_mailbox(self, callback=None):
         """Returns a mailbox object that represents the [Gmail]/All Mail folder
@@ -114,15 +114,14 @@ class Account(object):
         @pygmail.errors.check_imap_response(callback)
         def _on_mailboxes(mailboxes):
             for box in mailboxes:
-                box_fn = box.full_name
-                if box_fn.find('(\HasNoChildren \All)') == 0 or box_fn.find('(\All \HasNoChildren)') == 0:
+                if '\\All' in box.flags:
                     return _cmd(callback, box)
             return _cmd(callback, None)
 
         if self.boxes:
             return _on_mailboxes(self.boxes)
         else:
-            return _cmd_cb(self.mailboxes, _on_mailboxes, bool(callback))
+            return _cmd_cb_direct(self.mailboxes, _on_mailboxes, bool(callback))
 
     def trash_mailbox(self, callback=None):
         """Returns a mailbox object that represents the [Gmail]/Trash folder
@@ -137,14 +136,14 @@ class Account(object):
         @pygmail.errors.check_imap_response(callback)
         def _on_mailboxes(mailboxes):
             for box in mailboxes:
-                if box.full_name.find('(\HasNoChildren \Trash)') == 0:
+                if '\\Trash' in box.flags:
                     return _cmd(callback, box)
             return _cmd(callback, None)
 
         if self.boxes:
             return _on_mailboxes(self.boxes)
         else:
-            return _cmd_cb(self.mailboxes, _on_mailboxes, bool(callback))
+            return _cmd_cb_direct(self.mailboxes, _on_mailboxes, bool(callback))
 
 
     def mailboxes(self, callback=None):
@@ -176,7 +175,7 @@ class Account(object):
                 else:
                     return _cmd_cb(connection.list, _on_mailboxes, bool(callback))
 
-            return _cmd_cb(self.connection, _on_connection, bool(callback))
+            return _cmd_cb_direct(self.connection, _on_connection, bool(callback))
 
 
     def get(self, mailbox_name, callback=None):
@@ -203,7 +202,7 @@ class Account(object):
                     return _cmd(callback, mailbox)
             return _cmd(callback, None)
 
-        return _cmd_cb(self.mailboxes, _retreived_mailboxes, bool(callback))
+        return _cmd_cb_direct(self.mailboxes, _retreived_mailboxes, bool(callback))
 
     def connection(self, callback=None):
         """Creates an authenticated connection to gmail over IMAP
@@ -239,7 +238,7 @@ class Account(object):
             else:
                 self.connected = True
                 if self.id_params:
-                    return _cmd_cb(self.id, _on_ids, bool(callback))
+                    return _cmd_cb_direct(self.id, _on_ids, bool(callback))
                 else:
                     return _cmd(callback, self.conn)
 
@@ -322,8 +321,8 @@ class Account(object):
         def _on_connection(connection):
             id_params = []
             for k, v in self.id_params.items():
-                id_params.append('"' + k + '"')
-                id_params.append('"' + v + '"')
+                id_params.append(quote(k))
+                id_params.append(quote(v))
             # The IMAPlib2 exposed version of the "ID" command doesn't
             # format the parameters the same way gmail wants them, so
             # we just do it ourselves (imaplib2 wraps them in an extra
@@ -332,4 +331,4 @@ class Account(object):
                            bool(callback), 'ID',
                            "(" + " ".join(id_params) + ")")
 
-        return _cmd_cb(self.connection, _on_connection, bool(callback))
+        return _cmd_cb_direct(self.connection, _on_connection, bool(callback))
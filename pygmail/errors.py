@@ -23,9 +23,8 @@ def check_imap_state(callback):
     """
     def decorator(func):
         def inner(*args, **kwargs):
-            conn = args[0]
-            if not isinstance(conn, imaplib.IMAP4) or conn.state == imaplib.imaplib.LOGOUT:
-                rs = IMAPClosedError('IMAP in state LOGOUT', func.__name__)
+            rs = check_for_connection_error(args[0], func.__name__)
+            if rs:
                 if callback:
                     return _cmd(callback, rs)
                 else:
@@ -36,6 +35,26 @@ def check_imap_state(callback):
     return decorator
 
 
+def check_for_connection_error(conn, context=None):
+    """Checks to see if the given imaplib2 connection can still be used to
+    make requests against (ie its not in LOGOUT).
+
+    Args:
+        conn -- The object that should be a usable imaplib2 connection
+
+    Keyword Args:
+        context -- Optional description of where the connection was being used
+
+    Returns:
+        An IMAPClosedError instance if the connection can't be used, and
+        otherwise None
+    """
+    if not isinstance(conn, imaplib.IMAP4) or conn.state == imaplib.imaplib.LOGOUT:
+        return IMAPClosedError('IMAP in state LOGOUT', context)
+    else:
+        return None
+
+
 def check_imap_response(callback, require_ok=True):
     """Decorator that checks to see if the given imap response is an error.
     If so, it is registered as the only argument to the given callback function
@@ -95,7 +114,7 @@ def check_for_response_error(imap_response, require_ok=True):
         response, cb_arg, error = imap_response
         if response is None:
             if __debug__:
-                _log.error(error[1])
+                _log(error[1])
             return IMAPError(error[1])
         else:
             typ, data = response
@@ -1,10 +1,15 @@
+import functools
+import itertools
+import logging
 import re
-import string
+from collections import OrderedDict
 import message as GM
-from pygmail.utilities import extract_data, _cmd_cb, _cmd, _cmd_in, _log
+from pygmail.utilities import extract_data, quote, _cmd_cb, _cmd_cb_direct, _cmd, _cmd_in, _log
 import pygmail.errors
+from pygmail.errors import check_for_response_error, check_for_connection_error
 
 GM_ID_EXTRACTOR = re.compile(r'\d+ \(X-GM-MSGID (\d+)\)')
+UID_EXTRACTOR = re.compile(r'\bUID (\d+)')
 
 uid_fields = 'X-GM-MSGID UID'
 meta_fields = 'INTERNALDATE X-GM-MSGID X-GM-LABELS UID FLAGS'
@@ -12,6 +17,9 @@ header_fields = 'BODY.PEEK[HEADER]'
 body_fields = 'BODY.PEEK[]'
 teaser_fields = 'BODY.PEEK[1]'
 
+# The FETCH requests sent to the server, built once at import.  Since they're
+# built with format(), they're interned explicitly so that every request
+# shares the same string object
 imap_queries = dict(
     gm_id='(X-GM-MSGID)',
     uid='({uid})'.format(uid=uid_fields),
@@ -21,149 +29,567 @@ imap_queries = dict(
                                                              teaser=teaser_fields),
     header='({meta} {header})'.format(meta=meta_fields, header=header_fields)
 )
+imap_queries = dict((k, intern(v)) for k, v in imap_queries.items())
 
-METADATA = 0
-HEADERS = 1
-BODY = 2
+
+def _fetch_kind(gm_ids, only_uids, full, teasers):
+    """Returns the name of the kind of FETCH (ie its key in imap_queries)
+    that should be made for the given combination of fetch options.  When
+    several options are set, they take precedence in the order given."""
+    if gm_ids:
+        return "gm_id"
+    elif only_uids:
+        return "uid"
+    elif full:
+        return "body"
+    elif teasers:
+        return "teaser"
+    else:
+        return "header"
+
+# Every combination of the (gm_ids, only_uids, full, teasers) boolean options
+FETCH_FLAGS = list(itertools.product((False, True), repeat=4))
+
+# The FETCH request to send for each combination of options, so the fetch
+# methods pick their request with a single lookup
+FETCH_REQUESTS = dict((flags, imap_queries[_fetch_kind(*flags)])
+                      for flags in FETCH_FLAGS)
+
+# The maximum number of messages requested in a single FETCH command
+FETCH_BATCH_SIZE = 200
+
+# The maximum number of batched FETCH commands that are waiting on the server
+# at any one time, when running in the event loop
+FETCH_CONCURRENCY = 10
+
+# The number of seconds to wait before first searching the trash again for a
+# deleted message gmail hasn't indexed yet.  Each later wait is twice as long
+DELETE_RETRY_DELAY = 0.5
+
+# The maximum number of message objects each mailbox keeps around for reuse
+# when the same messages are fetched again (ex. when paging back and forth
+# through a list of messages)
+MESSAGE_CACHE_SIZE = 512
+
+# Regular expression used to extract the human readable versions of mailbox
+# names from the full, IMAP versions.  The pattern's bound match method is
+# looked up once here, since its called for every mailbox constructed.
+MAILBOX_NAME_PATTERN = re.compile(r'\((.*?)\) "(.*)" (.*)')
+_name_match = MAILBOX_NAME_PATTERN.match
+
+# Simple regular expression matching anything other than a digit.  Message
+# counts are now read directly from SELECT's EXISTS data, so this is only
+# kept for code that used it through Mailbox.COUNT_PATTERN
+NON_DIGIT_PATTERN = re.compile(r'[^0-9]')
+
+# The maximum number of parsed LIST lines kept around, across every account
+# in the process
+LIST_LINE_CACHE_SIZE = 4096
+
+# The (flags, delimiter, name) parsed out of recently seen LIST lines, keyed
+# by the line itself, oldest first.  Accounts re-LIST the same handful of
+# mailboxes over and over, so each line only needs to go through the
+# pattern once while it's in use.  Bounded the same way as each mailbox's
+# message cache, since this is shared by every account in the process
+_list_lines = OrderedDict()
+
+
+def _parse_list_line(full_name):
+    parsed = _list_lines.pop(full_name, None)
+    if parsed is None:
+        flags, delimiter, name = _name_match(full_name).groups()
+        parsed = (tuple(flags.split()), delimiter, name)
+        if len(_list_lines) >= LIST_LINE_CACHE_SIZE:
+            _list_lines.popitem(last=False)
+    _list_lines[full_name] = parsed
+    return parsed
 
 
 def parse_fetch_request(response, mailbox, teaser=False, full=False, gm_id=False):
+    """Parses the data returned by a FETCH command into message objects (or
+    gmail ids).
 
-    messages = []
+    Args:
+        response -- The data section of the response to the FETCH command
+        mailbox  -- The pygmail.mailbox.Mailbox the messages were fetched from
+
+    Keyword Args:
+        teaser -- Whether teaser versions of the messages were fetched
+        full   -- Whether full versions of the messages were fetched
+        gm_id  -- Whether only X-GM-MSGID values were fetched
 
-    # Quickly we can search for the simplest case, where we have no
-    # message parts to return
+    Returns:
+        A list of zero or more message objects or gmail ids
+    """
+    parser = FETCH_PARSERS[(bool(gm_id), False, bool(full), bool(teaser))]
+    return parser(response, mailbox)
+
+
+# Each of the below functions parses the data returned by one kind of FETCH
+# request into a list of values.  Since the kind of request is fixed for a
+# whole fetch, the right one is picked once (from FETCH_PARSERS) instead of
+# re-checking the fetch options for every response.
+#
+# Quickly we can search for the simplest case, where we have no message
+# parts to return, ie where the response is empty or [None]
+
+def _parse_gm_ids(response, mailbox):
+    # As with uids, the ids are pulled out of all the response lines in one
+    # scan, rather than matching each line separately
+    return GM_ID_EXTRACTOR.findall("\n".join(filter(None, response)))
+
+
+def _parse_uids(response, mailbox):
+    # Pull every UID out of the response in a single scan, instead of
+    # tokenizing each response line.  This also doesn't depend on the
+    # order the server returns the requested fields in
+    return UID_EXTRACTOR.findall(" ".join(filter(None, response)))
+
+
+def _parse_teasers(response, mailbox):
+    # Each teaser comes back as a nested tuple of (metadata, headers), an
+    # optional nested tuple of (BODY[1] marker, body text), and finally a
+    # string terminator (either a closing paren, or a "BODY[1] NIL)" marker
+    # when the message has no first section).  So a single pass over the
+    # parts is enough to pick each message apart, without inspecting the
+    # contents of any of them.
     if not response or not response[0]:
-        return messages
-
-    message_complete = False
-
-    if gm_id:
-        for part in response:
-            gm_id_match = GM_ID_EXTRACTOR.match(part)
-            if gm_id_match:
-                messages.append(gm_id_match.group(1))
-    elif teaser:
-        end_metadata = False
-        end_header = False
-        metadata_section = ''
-        header_section = ''
-        body_section = ''
-        for part in response:
-            if isinstance(part, basestring):
-                message_complete = True
+        return []
+    messages = []
+    # Looked up once here, rather than once per part / message in the loop
+    append = messages.append
+    cached_message = mailbox._cached_message
+    teaser_class = GM.MessageTeaser
+    metadata = None
+    # imaplib2 only ever hands back tuples (for literals) and plain strings,
+    # so an exact type check is enough to tell them apart
+    for part in response:
+        if type(part) is tuple:
+            if metadata is None:
+                metadata, headers = part
+                body = ''
             else:
-                for sub_part in part:
-                    if not end_metadata:
-                        metadata_section += sub_part
-                        if 'BODY[HEADER]' in sub_part:
-                            end_metadata = True
-                    elif not end_header:
-                        if 'BODY[1]' in sub_part:
-                            end_header = True
-                        else:
-                            header_section += sub_part
-                        if 'BODY[1] NIL)' in sub_part:
-                            message_complete = True
-                    else:
-                        body_section += sub_part
-            if message_complete:
-                messages.append(GM.MessageTeaser(mailbox,
-                                                 metadata=metadata_section,
-                                                 headers=header_section,
-                                                 body=body_section))
-                message_complete = False
-                end_metadata = False
-                end_header = False
-                metadata_section = ''
-                header_section = ''
-                body_section = ''
-    # Full messages just come in two tuples, the first being the full message
-    # test, and the second a terminator
-    elif full:
-        message_parts = []
-        for part in response:
-            # The first thing we expect to see when iterating over parts of
-            # a fill message is a single tuple, with two parts in it (ie
-            # a nested tuple).  The first part will be the metadata, the second
-            # will be both the headers and the body (since the message class
-            # parses both from the same contents)
-            if len(message_parts) == 0:
-                message_parts.append(part[0])
-                message_parts.append(part[1])
-                message_parts.append(part[1])
-            # Before we complete the message though, we need to read off the
-            # terminating section of the complete message. The below check
-            # has the effect of ignoring every part of a set of full messages
-            elif len(message_parts) == 3:
-                message_complete = True
-
-            if message_complete:
-                messages.append(GM.Message(mailbox,
-                                           metadata=message_parts[METADATA],
-                                           headers=message_parts[HEADERS],
-                                           body=message_parts[BODY]))
-                message_parts[:] = []
-                message_complete = False
-    # The remaining option is that we're only reading headers from the mailbox
-    # in this case, we also expect pairs of values, the first being a nested
-    # tuple of headers and metadata (ie [(metadata, headers)]), and following
-    # that a terminating paren character
-    else:
-        message_parts = []
-        for part in response:
-            # If we don't currently have any message parts capture,
-            # we expect the next chunk to be a tuple, which is nested and
-            # contains two subparts, the metadata and the headers
-            if len(message_parts) == 0:
-                message_parts.append(part[0])
-                message_parts.append(part[1])
-            # Otherwise, we expect to see a terminator character, which we
-            # ignore / don't store, and complete the message
-            elif len(message_parts) == 2:
-                message_complete = True
-
-            if message_complete:
-                messages.append(GM.MessageHeaders(mailbox,
-                                                  metadata=message_parts[METADATA],
-                                                  headers=message_parts[HEADERS]))
-                message_parts[:] = []
-                message_complete = False
+                body = part[1]
+        elif metadata is not None:
+            append(cached_message(teaser_class, metadata, headers, body))
+            metadata = None
     return messages
 
 
-def page_from_list(a_list, limit, offset):
-    """ Retreives the paginated section from the provided list
+# Full messages, and messages with only their headers, both come in pairs of
+# parts: a nested tuple of (metadata, message text), followed by a
+# terminating paren character.  So every other part is a complete message,
+# and the terminators can be skipped over entirely.  Masking off the low bit
+# of the length drops a trailing message that never received its
+# terminator.  The pairs are read with islice, which walks the response in
+# place instead of copying every other part into a new list.
 
-    Helps pagination needs by extracting only the section of the given list
-    described by the limit and offset parameters w/o causing invalid index
-    errors.
+def _parse_full_messages(response, mailbox):
+    if not response or not response[0]:
+        return []
+    # Full messages parse both the headers and the body from the same
+    # message text
+    message_class = GM.Message
+    return [message_class(mailbox, metadata=metadata, headers=message_text,
+                          body=message_text)
+            for metadata, message_text in itertools.islice(response, 0,
+                                                           len(response) & ~1, 2)]
+
+
+def _parse_headers(response, mailbox):
+    if not response or not response[0]:
+        return []
+    cached_message = mailbox._cached_message
+    headers_class = GM.MessageHeaders
+    return [cached_message(headers_class, metadata, headers)
+            for metadata, headers in itertools.islice(response, 0,
+                                                      len(response) & ~1, 2)]
+
+# The function that parses the response to each combination of fetch
+# options, matching the request sent for them in FETCH_REQUESTS
+FETCH_PARSERS = dict((flags, {"gm_id": _parse_gm_ids,
+                              "uid": _parse_uids,
+                              "body": _parse_full_messages,
+                              "teaser": _parse_teasers,
+                              "header": _parse_headers}[_fetch_kind(*flags)])
+                     for flags in FETCH_FLAGS)
+
+
+def _compact_ids(ids):
+    """Builds an IMAP message set out of a list of uids or sequence numbers,
+    collapsing each run of consecutive ids into a single "first:last" range
+    (ex. ['1', '2', '3', '7'] becomes "1:3,7").  The ids are not reordered,
+    and are joined as is if any of them aren't numeric.
 
     Args:
-        a_list -- A list of any length
-        limit  -- The maximum number of elements to return from the list.
-                  If False, no items will be truncated
-        offset -- The index of the first element in the list to return
+        ids -- A non-empty list of message uids or sequence numbers, given
+               either as strings or as ints
 
-    Return:
-        A slice from the given list with at most "limit" elements, or all
-        elements after offset if limit is False
+    Returns:
+        A string that can be passed to the FETCH command as a message set
+    """
+    try:
+        nums = [int(i) for i in ids]
+    except ValueError:
+        return ",".join(ids)
+
+    ranges = []
+    start = prev = nums[0]
+    for num in nums[1:]:
+        if num != prev + 1:
+            ranges.append(str(start) if start == prev else "%d:%d" % (start, prev))
+            start = num
+        prev = num
+    ranges.append(str(start) if start == prev else "%d:%d" % (start, prev))
+    return ",".join(ranges)
+
+
+def _expand_ids(id_set):
+    """Expands an IMAP message set, as built by _compact_ids, back into a
+    list of the ids in it (ex. "1:3,7" becomes ['1', '2', '3', '7']).
 
+    Args:
+        id_set -- A string message set, made up of comma separated numbers
+                  and "first:last" ranges
+
+    Returns:
+        A list of the ids in the set, as strings
     """
-    count = len(a_list)
-    # If the given offset is greater than the total number
-    # of messages in the inbox, there are no messages to return
-    if count <= offset:
-        return []
-    else:
-        first_elm_index = offset
+    ids = []
+    for part in id_set.split(","):
+        if ":" in part:
+            first, last = sorted(int(num) for num in part.split(":"))
+            ids.extend(str(num) for num in xrange(first, last + 1))
+        else:
+            ids.append(part)
+    return ids
 
-    if limit is False:
-        return a_list[first_elm_index:]
-    else:
-        last_req_item = offset + limit
-        last_elm_index = count if last_req_item >= count else last_req_item
-        return a_list[first_elm_index:last_elm_index]
+
+class _MessageDeletion(object):
+    """Carries a call to Mailbox.delete_message or
+    Mailbox.bulk_delete_messages through the IMAP commands it takes: copying
+    the messages to the trash, then finding the copies there by their
+    Message-IDs, and flagging and expunging them.  However many messages are
+    being deleted, each of these steps is a single IMAP command.
+
+    Each step is a method on this object, which holds the state shared
+    between the steps, instead of a closure that would be rebuilt on every
+    call to delete_message.
+
+    Every IMAP command here goes through _cmd_cb, so that each step runs on
+    the event loop.  imaplib2 calls its callbacks from its own handler
+    thread, and issuing the next command (SELECT in particular) from that
+    thread can wait forever on the thread that's issuing it.
+    """
+
+    __slots__ = ('mailbox', 'uids', 'message_ids', 'trash_folder', 'callback',
+                 'is_async', 'connection', 'num_tries', 'trash_uids')
+
+    def __init__(self, mailbox, uids, message_ids, trash_folder, callback):
+        """
+        Args:
+            mailbox      -- The pygmail.mailbox.Mailbox the messages are in
+            uids         -- a list of uids of messages in the mailbox
+            message_ids  -- a list of the message ids, from the email headers
+                            of each message to delete
+            trash_folder -- the name of the folder / label that is, in the
+                            current account, the trash container
+            callback     -- The callback given to delete_message, if any
+        """
+        self.mailbox = mailbox
+        self.uids = uids
+        self.message_ids = message_ids
+        self.trash_folder = trash_folder
+        self.callback = callback
+        self.is_async = bool(callback)
+        self.connection = None
+        self.num_tries = 0
+        # The uids the copies were given in the trash, if the server said
+        self.trash_uids = None
+
+    def _error_in(self, imap_response):
+        """Returns an error object if the given response is an error, or if
+        the connection can no longer be used, and otherwise None"""
+        return (check_for_response_error(imap_response) or
+                check_for_connection_error(self.connection, "delete_message"))
+
+    def start(self):
+        return self.mailbox._ensure_selected(self.on_connection, self.callback)
+
+    def on_connection(self, connection):
+        error = check_for_connection_error(connection, "delete_message")
+        if error:
+            return _cmd(self.callback, error)
+        self.connection = connection
+        return _cmd_cb(connection.uid, self.on_message_moved, self.is_async,
+                       'COPY', _compact_ids(self.uids), self.trash_folder)
+
+    def on_message_moved(self, imap_response):
+        error = self._error_in(imap_response)
+        if error:
+            return _cmd(self.callback, error)
+        # Servers that support UIDPLUS (gmail included) say which uids the
+        # copies were given in the trash, as a "COPYUID <uidvalidity>
+        # <source uids> <trash uids>" response code.  imaplib2 holds onto it
+        # until asked, so reading it costs no round trip
+        copy_uid = self.connection.response('COPYUID')[1][-1]
+        copy_uid_parts = copy_uid.split() if copy_uid else ()
+        if len(copy_uid_parts) == 3:
+            self.trash_uids = frozenset(_expand_ids(copy_uid_parts[2]))
+
+        # The trash is about to become the selected mailbox, so the original
+        # mailbox will need to be selected again before it's next used
+        self.mailbox.account.last_viewed_mailbox = None
+        return _cmd_cb(self.connection.select, self.on_trash_selected,
+                       self.is_async, self.trash_folder)
+
+    def on_trash_selected(self, imap_response):
+        error = self._error_in(imap_response)
+        if error:
+            return _cmd(self.callback, error)
+        return self.search_trash()
+
+    def search_trash(self):
+        # It can take several attempts for the deleted messages to show up
+        # in the trash label / folder.  We'll try 5 times, backing off
+        # exponentially from DELETE_RETRY_DELAY between attempts (see
+        # on_search_complete)
+        error = check_for_connection_error(self.connection, "delete_message")
+        if error:
+            return _cmd(self.callback, error)
+        query = " OR ".join("rfc822msgid:{msg_id}".format(msg_id=message_id)
+                            for message_id in self.message_ids)
+        return _cmd_cb(self.connection.uid, self.on_search_complete,
+                       self.is_async, 'search', None, 'X-GM-RAW', quote(query))
+
+    def on_search_complete(self, imap_response):
+        error = self._error_in(imap_response)
+        if error:
+            return _cmd(self.callback, error)
+        data = extract_data(imap_response)
+
+        # Its possible here that we've tried to select the messages
+        # we want to delete from the trash bin before google has
+        # registered them there for us.  If our search attempt returned
+        # a uid for each message, then we're good to go and can continue.
+        #
+        # The trash can also hold older copies of the same messages, which
+        # match the same Message-IDs but must not be expunged.  So if the
+        # server told us which uids the copies were given, only those uids
+        # are deleted, once every one of them shows up.  Otherwise, only an
+        # exact match between the uids found and the messages deleted is
+        # trusted.
+        found_uids = data[0].split() if data and data[0] else []
+        if self.trash_uids is not None:
+            deleted_uids = [uid for uid in found_uids if uid in self.trash_uids]
+            found_all = len(deleted_uids) == len(self.trash_uids)
+        else:
+            deleted_uids = found_uids
+            found_all = len(deleted_uids) == len(self.message_ids)
+        if deleted_uids and found_all:
+            return _cmd_cb(self.connection.uid, self.on_delete_complete,
+                           self.is_async, 'STORE', _compact_ids(deleted_uids),
+                           'FLAGS', '\\Deleted')
+
+        # If not though, we should wait a little while and try
+        # again.  We'll do this a maximum of 5 times.  If we still
+        # haven't had any luck at this point, we give up and return
+        # False, indiciating we weren't able to delete the messages
+        # fully.
+        else:
+            self.num_tries += 1
+
+            # If this is the 5th time we're trying to delete this
+            # message, we're going to call it a loss and stop trying.
+            # Otherwise, schedule another attempt and hope that gmail has
+            # updated its indexes by then.  The wait doubles each time
+            # (0.5, 1, 2 then 4 seconds), so the common case of gmail
+            # being just a little behind is retried quickly, while slow
+            # cases still get about as long in total as before
+            if self.num_tries == 5:
+                _log("Giving up trying to delete message", level=logging.DEBUG)
+                _log("got response: {response}".format(response=str(imap_response)),
+                     level=logging.DEBUG)
+                return _cmd(self.callback, False)
+            else:
+                delay = DELETE_RETRY_DELAY * 2 ** (self.num_tries - 1)
+                _log("Try {num} to delete deleting message.  Waiting {delay} sec".format(num=self.num_tries, delay=delay),
+                     level=logging.DEBUG)
+                _log("got response: {response}".format(response=str(imap_response)),
+                     level=logging.DEBUG)
+                return _cmd_in(self.search_trash, delay, self.is_async)
+
+    def on_delete_complete(self, imap_response):
+        error = self._error_in(imap_response)
+        if error:
+            return _cmd(self.callback, error)
+        return _cmd_cb(self.connection.expunge, self.on_expunge_complete,
+                       self.is_async)
+
+    def on_expunge_complete(self, imap_response):
+        error = self._error_in(imap_response)
+        if error:
+            return _cmd(self.callback, error)
+        # The trash is left selected.  Since the account no longer has a
+        # last viewed mailbox, whichever mailbox is used next (including this
+        # one, for the next in a run of deletions) will be selected then, so
+        # there's no point in spending a round trip reselecting this one now
+        self.mailbox.invalidate()
+        return _cmd(self.callback, True)
+
+
+class _BatchedFetch(object):
+    """Carries a call to Mailbox._fetch_batched through its FETCH commands,
+    one per batch of ids, and collects (or streams) the parsed results.
+
+    As with _MessageDeletion, each step is a method on this object, which
+    holds the state shared between the batches, instead of a set of
+    closures (and single item lists standing in for shared counters) that
+    would be rebuilt on every fetch.
+
+    When running in the event loop, later batches are sent on later turns
+    of the loop, by which point some other call may have selected a
+    different mailbox on the same connection.  So before each batch is
+    sent, the mailbox is selected again if it's no longer the account's
+    selected mailbox.
+    """
+
+    __slots__ = ('mailbox', 'batches', 'by_uid', 'request', 'parse',
+                 'unwrap', 'callback', 'is_async', 'on_batch', 'concurrency',
+                 'results', 'remaining', 'num_streamed', 'next_batch',
+                 'num_waiting', 'fetch')
+
+    def __init__(self, mailbox, ids, by_uid, flags, unwrap, callback,
+                 on_batch, batch_size, concurrency):
+        """
+        Args:
+            mailbox     -- The pygmail.mailbox.Mailbox to fetch messages from
+            ids         -- A list of one or more uids or sequence numbers
+            by_uid      -- Whether ids are uids (True) or sequence numbers
+            flags       -- The (gm_ids, only_uids, full, teasers) flags
+                           picking the request and parser to use
+            unwrap      -- Whether to return only the first message found
+            callback    -- The callback given to _fetch_batched, if any
+            on_batch    -- Optional function to stream each batch to
+            batch_size  -- The maximum number of ids in each FETCH command
+            concurrency -- The maximum number of FETCH commands in flight
+        """
+        self.mailbox = mailbox
+        self.batches = [ids[i:i + batch_size]
+                        for i in xrange(0, len(ids), batch_size)]
+        self.by_uid = by_uid
+        self.request = FETCH_REQUESTS[flags]
+        self.parse = FETCH_PARSERS[flags]
+        self.unwrap = unwrap
+        self.callback = callback
+        self.is_async = bool(callback)
+        self.on_batch = on_batch
+        self.concurrency = concurrency
+        self.results = [None] * len(self.batches)
+        self.remaining = len(self.batches)
+        self.num_streamed = 0
+        self.next_batch = 0
+        # The number of batches waiting for the mailbox to be selected
+        # again before they can be sent
+        self.num_waiting = 0
+        self.fetch = None
+
+    def start(self):
+        return self.mailbox._ensure_selected(self.on_connection, self.callback)
+
+    def on_connection(self, connection):
+        error = check_for_connection_error(connection, "_fetch_batched")
+        if error:
+            return _cmd(self.callback, error)
+
+        if self.by_uid:
+            self.fetch = functools.partial(connection.uid, "FETCH")
+        else:
+            self.fetch = connection.fetch
+
+        if self.is_async:
+            num_to_send = min(self.concurrency, len(self.batches))
+        else:
+            num_to_send = len(self.batches)
+
+        for _ in xrange(num_to_send):
+            rs = self.send_next_batch()
+            # In blocking mode, stop sending requests as soon as one fails
+            if self.remaining == 0:
+                break
+        return rs
+
+    def on_reselected(self, connection):
+        error = check_for_connection_error(connection, "_fetch_batched")
+        if error:
+            self.remaining = 0
+            return _cmd(self.callback, error)
+        num_to_send = self.num_waiting
+        self.num_waiting = 0
+        rs = None
+        for _ in xrange(num_to_send):
+            rs = self.send_next_batch()
+            # As in on_connection, stop once one fails (or, in blocking
+            # mode, once the last batch has been handled), and hand back
+            # its result
+            if self.remaining == 0:
+                break
+        return rs
+
+    def send_next_batch(self):
+        # If another mailbox has been selected since the last batch was sent,
+        # the uids (or sequence numbers) would be looked up in the wrong
+        # mailbox.  Only one SELECT is sent however many batches are waiting
+        if self.mailbox is not self.mailbox.account.last_viewed_mailbox:
+            self.num_waiting += 1
+            if self.num_waiting == 1:
+                return self.mailbox._ensure_selected(self.on_reselected,
+                                                     self.callback)
+            return None
+
+        batch_index = self.next_batch
+        self.next_batch += 1
+        return _cmd_cb(self.fetch, self.on_fetch, self.is_async,
+                       _compact_ids(self.batches[batch_index]), self.request,
+                       callback_args=dict(batch_index=batch_index))
+
+    def on_fetch(self, imap_response, batch_index):
+        # If an earlier batch failed, the callback has already been
+        # given the error, so there is nothing left to do here
+        if self.remaining == 0:
+            return None
+
+        error = check_for_response_error(imap_response)
+        if error:
+            self.remaining = 0
+            return _cmd(self.callback, error)
+
+        # Keep the pipeline full by sending the next waiting batch before
+        # parsing this one.  In blocking mode the batches are all sent,
+        # one after another, from on_connection instead
+        if (self.is_async and
+                self.next_batch + self.num_waiting < len(self.batches)):
+            self.send_next_batch()
+
+        messages = self.parse(extract_data(imap_response), self.mailbox)
+        self.remaining -= 1
+
+        # When streaming, hand each batch off as soon as its parsed, and
+        # don't hold on to any of them
+        if self.on_batch:
+            self.num_streamed += len(messages)
+            self.on_batch(messages)
+            if self.remaining == 0:
+                return _cmd(self.callback, self.num_streamed)
+            return None
+
+        self.results[batch_index] = messages
+        if self.remaining == 0:
+            messages = [msg for batch in self.results for msg in batch]
+            if self.unwrap:
+                return _cmd(self.callback, messages[0] if messages else None)
+            else:
+                return _cmd(self.callback, messages)
 
 
 class Mailbox(object):
@@ -174,12 +600,17 @@ class Mailbox(object):
 
     """
 
+    # Accounts can have hundreds of labels, each represented by a Mailbox
+    # instance, so instances don't carry a per-instance __dict__
+    __slots__ = ('account', 'conn', 'full_name', 'name', 'flags',
+                 'delimiter', 'uid_validity', '_exists_cache', '_msg_cache')
+
     # Classwide regular expression used to extract the human readable versions
     # of the mailbox names from the full, IMAP versions
-    NAME_PATTERN = re.compile(r'\((.*?)\) "(.*)" (.*)')
+    NAME_PATTERN = MAILBOX_NAME_PATTERN
 
     # Classwide, simple regular expression to only digits in a string
-    COUNT_PATTERN = re.compile(r'[^0-9]')
+    COUNT_PATTERN = NON_DIGIT_PATTERN
 
     def __init__(self, account, full_name):
         """ Initilizes a mailbox object
@@ -194,32 +625,148 @@ class Mailbox(object):
         self.account = account
         self.conn = account.connection
         self.full_name = full_name
-        self.name = Mailbox.NAME_PATTERN.match(full_name).groups()[2]
+        self.flags, self.delimiter, self.name = _parse_list_line(full_name)
+
+        # The UIDVALIDITY the server reported the last time this mailbox was
+        # selected, or None if it hasn't been selected yet.  If this changes,
+        # any uids previously seen in this mailbox no longer refer to the
+        # same messages.
+        self.uid_validity = None
+
+        # The number of messages the server reported as existing in this
+        # mailbox the last time it was selected.  This is only trusted while
+        # this mailbox is still the account's selected mailbox, and is
+        # cleared whenever we know the number of messages has changed.
+        self._exists_cache = None
+
+        # Recently built, read only message objects (headers and teasers),
+        # keyed by their class and the metadata the server returned for them.
+        # Created lazily, since most mailboxes are never fetched from.
+        self._msg_cache = None
 
     def __str__(self):
         return "<Mailbox: %s>" % (self.name,)
 
+    def invalidate(self):
+        """Clears the locally cached count of messages in the mailbox, forcing
+        the next call to count() to re-select the mailbox on the IMAP server,
+        along with any cached message objects.
+        """
+        self._exists_cache = None
+        self._msg_cache = None
+
+    def _cached_message(self, message_class, metadata, *args):
+        """Returns a message object built from a FETCH response, reusing an
+        already built one if the same message was recently fetched with
+        exactly the same metadata.
+
+        The metadata includes the message's sequence number, UID, gmail id,
+        labels and flags, so any change to the message on the server produces
+        a cache miss instead of a stale object.  Since the same instance can
+        be handed to several callers, only read only message classes
+        (pygmail.message.MessageHeaders and pygmail.message.MessageTeaser)
+        should be built through this method.  pygmail.message.Message
+        objects can be changed (ex. by set_header or remove_attachment), so
+        full messages are never cached.
+
+        No locking is done here.  The FETCH parsers that call this method
+        run from _BatchedFetch.on_fetch, whose FETCH callbacks go through
+        _cmd_cb, so they run on the event loop (or on the calling thread when
+        used syncronously), never on imaplib2's handler thread.
+
+        Args:
+            message_class -- The pygmail.message class to build
+            metadata      -- The metadata section of the FETCH response for
+                             the message
+
+        All other arguments (ex. the headers, and the body of a teaser) are
+        passed along to the message_class constructor on a cache miss.  They
+        are taken positionally, since this is called for every message
+        parsed, and so shouldn't need a dict of keyword arguments built for
+        each call.
+
+        Returns:
+            An instance of message_class
+        """
+        key = (message_class, metadata)
+        cache = self._msg_cache
+        if cache is None:
+            cache = self._msg_cache = OrderedDict()
+        else:
+            message = cache.pop(key, None)
+            if message is not None:
+                cache[key] = message
+                return message
+        message = message_class(self, metadata, *args)
+        cache[key] = message
+        if len(cache) > MESSAGE_CACHE_SIZE:
+            cache.popitem(last=False)
+        return message
+
     def count(self, callback=None):
         """Returns a count of the number of emails in the mailbox
 
+        If this mailbox is already the selected mailbox in the account, the
+        count returned by the server when it was selected is reused, instead
+        of selecting the mailbox again.  So messages added or removed by
+        another client can go unnoticed until the mailbox is next selected
+        (or refreshed, as messages() does).  Changes made through pygmail
+        invalidate the cached count.
+
         Returns:
             The int value of the number of emails in the mailbox, or None on
             error
 
         """
         @pygmail.errors.check_imap_response(callback)
-        def _on_select_complete(imap_response):
-            data = extract_data(imap_response)
-            self.account.last_viewed_mailbox = self
-            msg_count = int(Mailbox.COUNT_PATTERN.sub("", str(data)))
-            return _cmd(callback, msg_count)
+        def _on_select_complete(imap_response, connection):
+            return _cmd(callback, self._on_selected(imap_response, connection))
 
         @pygmail.errors.check_imap_state(callback)
         def _on_connection(connection):
+            # Until the SELECT completes, no mailbox can be relied on as the
+            # selected one (see _ensure_selected)
+            self.account.last_viewed_mailbox = None
             return _cmd_cb(connection.select, _on_select_complete,
-                           bool(callback), self.name)
+                           bool(callback), self.name,
+                           callback_args=dict(connection=connection))
 
-        return _cmd_cb(self.account.connection, _on_connection, bool(callback))
+        if self is self.account.last_viewed_mailbox and self._exists_cache is not None:
+            return _cmd(callback, self._exists_cache)
+        else:
+            return _cmd_cb_direct(self.account.connection, _on_connection, bool(callback))
+
+    def _on_selected(self, imap_response, connection):
+        """Records that this mailbox has been selected, along with what the
+        server said about it in response to the SELECT.
+
+        Args:
+            imap_response -- The successful response to a SELECT of this
+                             mailbox
+            connection    -- The IMAP connection the SELECT was issued on
+
+        Returns:
+            The number of messages in the mailbox
+        """
+        data = extract_data(imap_response)
+        self.account.last_viewed_mailbox = self
+        # imaplib2 hands back the values of the untagged EXISTS
+        # responses to the SELECT, so the count can be read directly.
+        # The last one is the most recent, if there happen to be several
+        msg_count = int(data[-1])
+
+        # The UIDVALIDITY arrived with the same SELECT, and is held by
+        # imaplib2 until asked for, so reading it costs no round trip
+        uid_validity = connection.response('UIDVALIDITY')[1][-1]
+        if uid_validity is not None:
+            uid_validity = int(uid_validity)
+
+        if (msg_count != self._exists_cache or
+                uid_validity != self.uid_validity):
+            self._msg_cache = None
+        self._exists_cache = msg_count
+        self.uid_validity = uid_validity
+        return msg_count
 
     def delete_message(self, uid, message_id, trash_folder, callback=None):
         """Allows for deleting a message by UID, without needing to pulldown
@@ -235,106 +782,30 @@ class Mailbox(object):
         Returns:
             A boolean description of whether a message was successfully deleted
         """
-        @pygmail.errors.check_imap_response(callback)
-        def _on_original_mailbox_reselected(imap_response):
-            return _cmd(callback, True)
-
-        @pygmail.errors.check_imap_state(callback)
-        def _on_recevieved_connection_7(connection):
-            return _cmd_cb(connection.select, _on_original_mailbox_reselected,
-                           bool(callback))
+        return _MessageDeletion(self, [uid], [message_id], trash_folder,
+                                callback).start()
 
-        @pygmail.errors.check_imap_response(callback)
-        def _on_expunge_complete(imap_response):
-            return _cmd_cb(self.conn, _on_recevieved_connection_7, bool(callback))
-
-        @pygmail.errors.check_imap_state(callback)
-        def _on_recevieved_connection_6(connection):
-            return _cmd_cb(connection.expunge, _on_expunge_complete, bool(callback))
-
-        @pygmail.errors.check_imap_response(callback)
-        def _on_delete_complete(imap_response):
-            return _cmd_cb(self.conn, _on_recevieved_connection_6, bool(callback))
-
-        @pygmail.errors.check_imap_state(callback)
-        def _on_received_connection_4(connection, deleted_uid):
-            del self.num_tries
-            return _cmd_cb(connection.uid, _on_delete_complete, bool(callback),
-                            'STORE', deleted_uid, 'FLAGS', '\\Deleted')
-
-        @pygmail.errors.check_imap_response(callback)
-        def _on_search_for_message_complete(imap_response):
-            data = extract_data(imap_response)
+    def bulk_delete_messages(self, uids, message_ids, trash_folder,
+                             callback=None):
+        """Deletes several messages by UID at once.  This takes the same
+        number of IMAP commands as deleting a single message with
+        delete_message, no matter how many messages are deleted.
 
-            # Its possible here that we've tried to select the message
-            # we want to delete from the trash bin before google has
-            # registered it there for us.  If our search attempt returned
-            # a uid, then we're good to go and can continue.
-            try:
-                deleted_uid = data[0].split()[-1]
-                cbp = dict(deleted_uid=deleted_uid)
-                return _cmd_cb(self.conn, _on_received_connection_4,
-                               bool(callback), callback_args=cbp)
-
-            # If not though, we should wait a couple of seconds and try
-            # again.  We'll do this a maximum of 5 times.  If we still
-            # haven't had any luck at this point, we give up and return
-            # False, indiciating we weren't able to delete the message
-            # fully.
-            except IndexError:
-                self.num_tries += 1
-
-                # If this is the 5th time we're trying to delete this
-                # message, we're going to call it a loss and stop trying.
-                # We do some minimal clean up and then just bail out
-                # Otherwise, schedule another attempt in 2 seconds and
-                # hope that gmail has updated its indexes by then
-                if self.num_tries == 5:
-                    del self.num_tries
-                    if __debug__:
-                        _log.error("Giving up trying to delete message")
-                        _log.error("got response: {response}".format(response=str(imap_response)))
-                    return _cmd(callback, False)
-                else:
-                    if __debug__:
-                        _log.error("Try {num} to delete deleting message.  Waiting".format(num=self.num_tries))
-                        _log.error("got response: {response}".format(response=str(imap_response)))
-                    return _cmd_in(_on_trash_selected, 2, bool(callback))
-
-        @pygmail.errors.check_imap_state(callback)
-        def _on_received_connection_3(connection):
-            return _cmd_cb(connection.uid, _on_search_for_message_complete,
-                           bool(callback), 'search', None, 'X-GM-RAW',
-                            '"rfc822msgid:{msg_id}"'.format(msg_id=message_id))
-
-        @pygmail.errors.check_imap_response(callback)
-        def _on_trash_selected(imap_response):
-            # It can take several attempts for the deleted message to show up
-            # in the trash label / folder.  We'll try 5 times, waiting
-            # two sec between each attempt
-            return _cmd_cb(self.conn, _on_received_connection_3, bool(callback))
-
-        @pygmail.errors.check_imap_state(callback)
-        def _on_received_connection_2(connection):
-            self.num_tries = 0
-            return _cmd_cb(connection.select, _on_trash_selected, bool(callback))
-
-        @pygmail.errors.check_imap_response(callback)
-        def _on_message_moved(imap_response):
-            return _cmd_cb(self.conn, _on_received_connection_2, bool(callback))
-
-        @pygmail.errors.check_imap_state(callback)
-        def _on_connection(connection):
-            return _cmd_cb(connection.uid, _on_message_moved, bool(callback),
-                            'COPY', uid, trash_folder)
-
-        @pygmail.errors.check_imap_response(callback)
-        def _on_select(was_selected):
-            # self.account.connection(callback=_on_connection)
-            return _cmd_cb(self.account.connection, _on_connection,
-                           bool(callback))
+        Args:
+            uids         -- a list of uids for messages in the current mailbox
+            message_ids  -- the message ids, from the email headers of each
+                            of the messages to delete
+            trash_folder -- the name of the folder / label that is, in the
+                            current account, the trash container
 
-        return _cmd_cb(self.select, _on_select, bool(callback))
+        Returns:
+            A boolean description of whether the messages were successfully
+            deleted
+        """
+        if not uids:
+            return _cmd(callback, True)
+        return _MessageDeletion(self, uids, message_ids, trash_folder,
+                                callback).start()
 
     def delete(self, callback=None):
         """Removes the mailbox / folder from the current gmail account. In
@@ -358,7 +829,7 @@ class Mailbox(object):
                 return _cmd_cb(connection.delete, _on_mailbox_deletion,
                                bool(callback), self.name)
 
-        return _cmd_cb(self.account.connection, _on_connection, bool(callback))
+        return _cmd_cb_direct(self.account.connection, _on_connection, bool(callback))
 
     def select(self, callback=None):
         """Sets this mailbox as the current active one on the IMAP connection
@@ -372,17 +843,60 @@ class Mailbox(object):
             True if any changes were made, otherwise False
 
         """
-        def _on_count_complete(num):
-            self.account.last_viewed_mailbox = self
+        def _on_selected_connection(connection):
             return _cmd(callback, True)
 
         if self is self.account.last_viewed_mailbox:
             return _cmd(callback, False)
         else:
-            return _cmd_cb(self.count, _on_count_complete, bool(callback))
+            # _ensure_selected sends just the SELECT, and records the count
+            # and UIDVALIDITY the server returns along the way, so there's
+            # no need to go through count()
+            return self._ensure_selected(_on_selected_connection, callback)
+
+    def _ensure_selected(self, on_connection, callback):
+        """Makes sure this mailbox is selected on the account's IMAP connection,
+        and then passes that connection along to the given function.
+
+        If this mailbox is already the selected one, the connection is passed
+        along directly.  Otherwise the SELECT is sent on that same connection,
+        and the connection handed on once it completes, instead of going
+        through select() and count() and then fetching the connection again.
+
+        Args:
+            on_connection -- A function that takes the account's IMAP
+                             connection as its only argument
+            callback      -- The callback given to the calling method, which
+                             will receive any error that occurs
+
+        Returns:
+            The result of on_connection (if called syncronously)
+        """
+        @pygmail.errors.check_imap_response(callback)
+        def _on_select(imap_response, connection):
+            self._on_selected(imap_response, connection)
+            return on_connection(connection)
+
+        @pygmail.errors.check_imap_state(callback)
+        def _on_connection(connection):
+            # The account stops having a known selected mailbox as soon as
+            # the SELECT is sent, not once it completes, so that a batched
+            # fetch from another mailbox doesn't send its next FETCH while
+            # this SELECT is still in flight
+            self.account.last_viewed_mailbox = None
+            return _cmd_cb(connection.select, _on_select, bool(callback),
+                           self.name, callback_args=dict(connection=connection))
+
+        if self is self.account.last_viewed_mailbox:
+            return _cmd_cb_direct(self.account.connection, on_connection,
+                                  bool(callback))
+        else:
+            return _cmd_cb_direct(self.account.connection, _on_connection,
+                                  bool(callback))
 
     def search(self, term, limit=100, offset=0, only_uids=False,
-               full=False, callback=None, **kwargs):
+               full=False, callback=None, teaser=False, gm_ids=False,
+               batch_size=None):
         """Searches for messages in the inbox that contain a given phrase
 
         Seaches for a given phrase in the current mailbox, and returns a list
@@ -411,39 +925,49 @@ class Mailbox(object):
                             body (ie the first mime section).  Note that this
                             option is incompatible with the full
                             option, and the former will take precedence
+            batch_size   -- The maximum number of messages to request in each
+                            FETCH command.  Defaults to FETCH_BATCH_SIZE
 
 
         Returns:
             A list of messages or uids (depending on the call arguments) in case
             of success, and an IMAPError object in all other cases.
+            Header and teaser objects may be the same instances
+            returned by an earlier call that fetched the same messages,
+            so they should be treated as read only.  Full messages are
+            always new objects.
         """
-        teasers = kwargs.get("teaser")
-        gm_ids = kwargs.get('gm_ids')
-
         def _on_messages_by_id(messages):
             return _cmd(callback, messages)
 
         @pygmail.errors.check_imap_response(callback)
         def _on_search(imap_response):
             data = extract_data(imap_response)
-            ids = string.split(data[0])
-            ids_to_fetch = page_from_list(ids, limit, offset)
-            return _cmd_cb(self.messages_by_id, _on_messages_by_id,
-                           bool(callback), ids_to_fetch, only_uids=only_uids,
-                           full=full, teaser=teasers, gm_ids=gm_ids)
+
+            # Gmail doesn't advertise CONTEXT=SEARCH, so we can't ask the
+            # server for just the requested page (SEARCH RETURN (PARTIAL)).
+            # When paging, stop splitting the id list once we're past the
+            # end of the page, so that only the first offset + limit ids
+            # are ever split out of a potentially huge response.
+            if limit is False or limit is None:
+                ids_to_fetch = data[0].split()[offset:]
+            else:
+                end = offset + limit
+                ids_to_fetch = data[0].split(None, end)[offset:end]
+            return _cmd_cb_direct(self.messages_by_id, _on_messages_by_id,
+                                  bool(callback), ids_to_fetch, only_uids=only_uids,
+                                  full=full, teaser=teaser, gm_ids=gm_ids,
+                                  batch_size=batch_size)
 
         @pygmail.errors.check_imap_state(callback)
         def _on_connection(connection):
             return _cmd_cb(connection.search, _on_search, bool(callback),
                            None, 'X-GM-RAW', term)
 
-        @pygmail.errors.check_imap_response(callback)
-        def _on_mailbox_selected(was_changed):
-            return _cmd_cb(self.account.connection, _on_connection, bool(callback))
-
-        return _cmd_cb(self.select, _on_mailbox_selected, bool(callback))
+        return self._ensure_selected(_on_connection, callback)
 
-    def messages(self, limit=100, offset=0, callback=None, **kwargs):
+    def messages(self, limit=100, offset=0, callback=None, only_uids=False,
+                 full=False, teaser=False, gm_ids=False, batch_size=None):
         """Returns a list of all the messages in the inbox
 
         Fetches a list of all messages in the inbox.  This list is by default
@@ -466,6 +990,8 @@ class Mailbox(object):
                          body (ie the first mime section).  Note that this
                          option is incompatible with the full
                          option, and the former will take precedence
+            batch_size -- The maximum number of messages to request in each
+                          FETCH command.  Defaults to FETCH_BATCH_SIZE
 
         Return:
 
@@ -473,37 +999,80 @@ class Mailbox(object):
             list of zero or more pygmail.message.Message objects (or uids if
             only_uids is TRUE), or None if no information could be found about
             the mailbox. The second element is the total number of messages (not
-            just those returned from the limit-offset parameters)
+            just those returned from the limit-offset parameters).
+            Header and teaser objects may be the same instances
+            returned by an earlier call that fetched the same messages,
+            so they should be treated as read only.  Full messages are
+            always new objects.
 
         """
-        teasers = kwargs.get('teaser')
-        full = kwargs.get('full')
-        only_uids = kwargs.get('only_uids')
-        gm_ids = kwargs.get('gm_ids')
-
         def _on_messages_by_id(messages):
             return _cmd(callback, messages)
 
+        # Every message in the mailbox has a sequence number between 1 and
+        # the number of messages in the mailbox, so the requested page can
+        # be worked out from the count alone, instead of SEARCHing for, and
+        # then slicing, the ids of every message in the mailbox
         @pygmail.errors.check_imap_response(callback)
-        def _on_search(imap_response):
-            data = extract_data(imap_response)
-            ids = string.split(data[0])
-            ids_to_fetch = page_from_list(ids, limit, offset)
-            return _cmd_cb(self.messages_by_id, _on_messages_by_id,
-                           bool(callback), ids_to_fetch, only_uids=only_uids,
-                           full=full, teaser=teasers, gm_ids=gm_ids)
+        def _on_count(num_messages):
+            if limit is False or limit is None:
+                end = num_messages
+            else:
+                end = min(offset + limit, num_messages)
+            # _compact_ids works on the numbers directly, so there's no
+            # need to build a string for each id only to parse it back
+            ids_to_fetch = range(offset + 1, end + 1)
+            return _cmd_cb_direct(self.messages_by_id, _on_messages_by_id,
+                                  bool(callback), ids_to_fetch,
+                                  only_uids=only_uids, full=full,
+                                  teaser=teaser, gm_ids=gm_ids,
+                                  batch_size=batch_size)
+
+        # Don't trust a previously cached count here, since new messages may
+        # have arrived since this mailbox was selected.  If the mailbox is
+        # already selected though, SELECTing it again would hold up every
+        # other command on the connection (imaplib2 waits for them all to
+        # finish before changing state).  A NOOP gives the server the chance
+        # to report any change in the number of messages instead, as an
+        # untagged EXISTS response, which imaplib2 holds onto until asked.
+        # If there wasn't one, the cached count is still current
+        @pygmail.errors.check_imap_response(callback)
+        def _on_noop(imap_response, connection):
+            exists = connection.response('EXISTS')[1][-1]
+            expunged = connection.response('EXPUNGE')[1]
+            # Expunged messages lower the count without an EXISTS response
+            # being sent, and the order of the two can't be told apart here,
+            # so in that (rare) case the mailbox is selected again
+            if expunged[-1] is not None:
+                self.invalidate()
+                return _cmd_cb_direct(self.count, _on_count, bool(callback))
+            if exists is not None:
+                self._exists_cache = int(exists)
+            return _on_count(self._exists_cache)
 
         @pygmail.errors.check_imap_state(callback)
         def _on_connection(connection):
-            return _cmd_cb(connection.search, _on_search, bool(callback), None, 'ALL')
+            return _cmd_cb(connection.noop, _on_noop, bool(callback),
+                           callback_args=dict(connection=connection))
 
-        @pygmail.errors.check_imap_response(callback)
-        def _on_select_complete(result):
-            return _cmd_cb(self.account.connection, _on_connection, bool(callback))
+        # Otherwise, the count the server returns when the mailbox is
+        # selected is current, and is recorded by _ensure_selected
+        def _on_selected_connection(connection):
+            return _on_count(self._exists_cache)
 
-        return _cmd_cb(self.select, _on_select_complete, bool(callback))
+        if self is self.account.last_viewed_mailbox:
+            if self._exists_cache is None:
+                # The count was invalidated while the mailbox stayed
+                # selected, so count() needs to select it again
+                return _cmd_cb_direct(self.count, _on_count, bool(callback))
+            return _cmd_cb_direct(self.account.connection, _on_connection,
+                                  bool(callback))
+        else:
+            return self._ensure_selected(_on_selected_connection, callback)
 
-    def fetch_all(self, uids, full=False, callback=None, **kwargs):
+    def fetch_all(self, uids, full=False, callback=None, teaser=False,
+                  gm_ids=False, on_batch=None, batch_size=None,
+                  concurrency=None):
         """Returns a list of messages, each specified by their UID
 
         Returns zero or more GmailMessage objects, each representing a email
@@ -522,42 +1091,37 @@ class Mailbox(object):
                        body (ie the first mime section).  Note that this
                        option is incompatible with the full
                        option, and the former will take precedence
+            on_batch -- If provided, a function that is passed each batch of
+                       messages as soon as it is fetched, so that large sets
+                       of messages never need to be held in memory at once.
+                       When a callback is given, batches may arrive out of
+                       order
+            batch_size -- The maximum number of messages to request in each
+                       FETCH command.  Defaults to FETCH_BATCH_SIZE
+            concurrency -- The maximum number of FETCH commands to have
+                       waiting on the server at once, when a callback is
+                       given.  Defaults to FETCH_CONCURRENCY
 
         Returns:
             Zero or more pygmail.message.Message objects, representing any
-            messages that matched a provided uid
+            messages that matched a provided uid.  If on_batch was provided,
+            the number of messages passed to it is returned instead.
+            Header and teaser objects may be the same instances
+            returned by an earlier call that fetched the same messages,
+            so they should be treated as read only.  Full messages are
+            always new objects.
         """
-        teasers = kwargs.get("teaser")
-        gm_ids = kwargs.get('gm_ids')
-
-        @pygmail.errors.check_imap_response(callback)
-        def _on_fetch(imap_response):
-            data = extract_data(imap_response)
-            messages = parse_fetch_request(data, self, teasers, full, gm_ids)
-            return _cmd(callback, messages)
-
-        @pygmail.errors.check_imap_state(callback)
-        def _on_connection(connection):
-            if gm_ids:
-                request = imap_queries["gm_id"]
-            elif full:
-                request = imap_queries["body"]
-            elif teasers:
-                request = imap_queries["teaser"]
-            else:
-                request = imap_queries["header"]
-            return _cmd_cb(connection.uid, _on_fetch, bool(callback),
-                           "FETCH", ",".join(uids), request)
-
-        def _on_select(result):
-            return _cmd_cb(self.account.connection, _on_connection, bool(callback))
-
         if uids:
-            return _cmd_cb(self.select, _on_select, bool(callback))
+            return self._fetch_batched(uids, True, False, full, teaser,
+                                       gm_ids, False, callback,
+                                       on_batch=on_batch,
+                                       batch_size=batch_size,
+                                       concurrency=concurrency)
         else:
             return _cmd(callback, None)
 
-    def fetch(self, uid, full=False, callback=None, **kwargs):
+    def fetch(self, uid, full=False, callback=None, teaser=False,
+              gm_ids=False):
         """Returns a single message from the mailbox by UID
 
         Returns a single message object, representing the message in the current
@@ -581,36 +1145,64 @@ class Mailbox(object):
             A pygmail.message.Message object representing the email message, or
             None if none could be found.  If an error is encountered, an
             IMAPError object will be returned.
+            Header and teaser objects may be the same instances
+            returned by an earlier call that fetched the same messages,
+            so they should be treated as read only.  Full messages are
+            always new objects.
         """
-        teasers = kwargs.get("teaser")
-        gm_ids = kwargs.get('gm_ids')
-
-        @pygmail.errors.check_imap_response(callback)
-        def _on_fetch(imap_response):
-            data = extract_data(imap_response)
-            messages = parse_fetch_request(data, self, teasers, full, gm_ids)
-            return _cmd(callback, messages[0] if len(messages) > 0 else None)
+        return self._fetch_batched([str(uid)], True, False, full, teaser,
+                                   gm_ids, True, callback)
+
+    def _fetch_batched(self, ids, by_uid, only_uids, full, teasers, gm_ids,
+                       unwrap, callback, on_batch=None, batch_size=None,
+                       concurrency=None):
+        """Shared implementation of fetch, fetch_all and messages_by_id,
+        which fetches one or more messages from the mailbox by their UIDs or
+        sequence numbers
+
+        Large sets of ids are fetched in several, smaller FETCH commands, so
+        that no single response has to hold an unbounded number of messages.
+        When running in the event loop up to `concurrency` of these are
+        waiting on the server at once (imaplib2 tags and dispatches each
+        response separately), with the next batch sent as each one returns,
+        and their results are stitched back together, in request order, once
+        the last one has returned.
 
-        @pygmail.errors.check_imap_state(callback)
-        def _on_connection(connection):
-            if gm_ids:
-                request = imap_queries["gm_id"]
-            elif full:
-                request = imap_queries["body"]
-            elif teasers:
-                request = imap_queries["teaser"]
-            else:
-                request = imap_queries["header"]
-            return _cmd_cb(connection.uid, _on_fetch, bool(callback),
-                           "FETCH", uid, request)
+        Args:
+            ids       -- A list of one or more email uids or sequence numbers
+            by_uid    -- Whether ids are uids (True) or sequence numbers
+            only_uids -- Whether to fetch only the uids of the messages
+            full      -- Whether to fetch the entire message
+            teasers   -- Whether to fetch teaser versions of the messages
+            gm_ids    -- Whether to fetch only the X-GM-MSGID values
+            unwrap    -- If True, only the first message found (or None) is
+                         returned, instead of a list of messages
+            callback  -- optional callback function
 
-        @pygmail.errors.check_imap_response(callback)
-        def _on_select(result):
-            return _cmd_cb(self.account.connection, _on_connection, bool(callback))
+        Keyword Args:
+            on_batch  -- If provided, a function that is given the list of
+                         messages parsed from each batch, as soon as each
+                         batch is parsed, instead of collecting them all
+                         into one list.  When running in the event loop,
+                         batches are passed along in the order they arrive,
+                         which isn't necessarily the order they were sent
+            batch_size -- The maximum number of ids to send in each FETCH
+                         command, or None to use FETCH_BATCH_SIZE
+            concurrency -- The maximum number of FETCH commands in flight at
+                         once, or None to use FETCH_CONCURRENCY
 
-        return _cmd_cb(self.select, _on_select, bool(callback))
+        Returns:
+            A list of zero or more messages, or a single message or None if
+            unwrap is True.  If on_batch was provided, the total number of
+            messages passed to it is returned instead.  If an error is
+            encountered, an IMAPError object will be returned.
+        """
+        flags = (bool(gm_ids), bool(only_uids), bool(full), bool(teasers))
+        return _BatchedFetch(self, ids, by_uid, flags, unwrap, callback,
+                             on_batch, batch_size or FETCH_BATCH_SIZE,
+                             concurrency or FETCH_CONCURRENCY).start()
 
-    def fetch_gm_id(self, gm_id, full=False, callback=None, **kwargs):
+    def fetch_gm_id(self, gm_id, full=False, callback=None, teaser=False):
         """Fetches a single message from the mailbox, specified by the
         given X-GM-MSGID.
 
@@ -641,21 +1233,19 @@ class Mailbox(object):
                 return _cmd(callback, None)
             else:
                 uid = data[0]
-                return _cmd_cb(self.fetch, _on_fetch, bool(callback),
-                               uid, full=full, **kwargs)
+                return _cmd_cb_direct(self.fetch, _on_fetch, bool(callback),
+                                      uid, full=full, teaser=teaser)
 
         @pygmail.errors.check_imap_state(callback)
         def _on_connection(connection):
             return _cmd_cb(connection.uid, _on_search_complete, bool(callback),
                            'search', None, 'X-GM-MSGID', gm_id)
 
-        @pygmail.errors.check_imap_response(callback)
-        def _on_select(result):
-            return _cmd_cb(self.account.connection, _on_connection, bool(callback))
-
-        return _cmd_cb(self.select, _on_select, bool(callback))
+        return self._ensure_selected(_on_connection, callback)
 
-    def messages_by_id(self, ids, only_uids=False, full=False, callback=None, **kwargs):
+    def messages_by_id(self, ids, only_uids=False, full=False, callback=None,
+                       teaser=False, gm_ids=False, on_batch=None,
+                       batch_size=None, concurrency=None):
         """Fetches messages in the mailbox by their id
 
         Returns a list of all messages in the current mailbox that match
@@ -672,50 +1262,41 @@ class Mailbox(object):
             full         -- Whether to fetch the entire message, instead of
                             just the headers.  Note that if only_uids is True,
                             this parameter will have no effect.
-            only_teasers -- Whether to fetch just a brief, teaser version of the
+            teaser       -- Whether to fetch just a brief, teaser version of the
                             body (ie the first mime section).  Note that this
                             option is incompatible with the full
                             option, and the former will take precedence
+            gm_ids       -- If True, only the unique, persistant X-GM-MSGID
+                            value for the email message will be returned
+            on_batch     -- If provided, a function that is passed each batch
+                            of messages (or uids) as soon as it is fetched, so
+                            that large sets of messages never need to be held
+                            in memory at once.  When a callback is given,
+                            batches may arrive out of order
+            batch_size   -- The maximum number of messages to request in each
+                            FETCH command.  Defaults to FETCH_BATCH_SIZE
+            concurrency  -- The maximum number of FETCH commands to have
+                            waiting on the server at once, when a callback
+                            is given.  Defaults to FETCH_CONCURRENCY
 
         Returns:
             A list of zero or more message objects (or uids) if success, and
-            an error object in all other situations
+            an error object in all other situations.  If on_batch was
+            provided, the number of messages passed to it is returned instead
+            of the list.
+            Header and teaser objects may be the same instances
+            returned by an earlier call that fetched the same messages,
+            so they should be treated as read only.  Full messages are
+            always new objects.
         """
-        teasers = kwargs.get("teaser")
-        gm_ids = kwargs.get('gm_ids')
-
         # If we were told to fetch no messages, fast "callback" and don't
-        # bother doing any network io
+        # bother doing any network io (or selecting the mailbox).  Callers
+        # streaming through on_batch get the count of messages passed
+        # along, as they would for any other request
         if len(ids) == 0:
-            return _cmd(callback, [])
-
-        @pygmail.errors.check_imap_response(callback)
-        def _on_fetch(imap_response):
-            data = extract_data(imap_response)
-            if only_uids:
-                uids = [string.split(elm, " ")[4][:-1] for elm in data]
-                return _cmd(callback, uids)
-            else:
-                messages = parse_fetch_request(data, self, teasers, full, gm_ids)
-                return _cmd(callback, messages)
-
-        @pygmail.errors.check_imap_state(callback)
-        def _on_connection(connection):
-            if gm_ids:
-                request = imap_queries["gm_id"]
-            elif only_uids:
-                request = imap_queries["uid"]
-            elif full:
-                request = imap_queries["body"]
-            elif teasers:
-                request = imap_queries["teaser"]
-            else:
-                request = imap_queries["header"]
-            return _cmd_cb(connection.fetch, _on_fetch, bool(callback),
-                           ",".join(ids), request)
-
-        @pygmail.errors.check_imap_response(callback)
-        def _on_select(result):
-            return _cmd_cb(self.account.connection, _on_connection, bool(callback))
+            return _cmd(callback, 0 if on_batch else [])
 
-        return _cmd_cb(self.select, _on_select, bool(callback))
+        return self._fetch_batched(ids, False, only_uids, full, teaser,
+                                   gm_ids, False, callback,
+                                   on_batch=on_batch, batch_size=batch_size,
+                                   concurrency=concurrency)
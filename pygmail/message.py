@@ -13,8 +13,8 @@ from quopri import encodestring, decodestring
 from email.parser import HeaderParser
 from email.Iterators import typed_subpart_iterator
 from pygmail.address import Address
-from pygmail.utilities import extract_data, extract_first_bodystructure, parse, ParseError, _cmd_in, _cmd_cb, _cmd, _log
-from pygmail.errors import is_encoding_error, check_for_response_error
+from pygmail.utilities import extract_data, extract_first_bodystructure, parse, ParseError, _cmd_cb, _cmd_cb_direct, _cmd, _log
+from pygmail.errors import is_encoding_error
 from hashlib import sha1
 
 
@@ -172,8 +172,8 @@ class MessageBase(object):
         metadata_rs = metadata_pattern.match(metadata)
 
         if not metadata_rs:
-            _log.error("Bad formatted metadata string")
-            _log.error(metadata)
+            _log("Bad formatted metadata string")
+            _log(metadata)
 
         self.id, self.gmail_id, labels, self.uid, internal_date = metadata_rs.groups()
         self.internal_date = Internaldate2tuple(metadata)
@@ -188,9 +188,9 @@ class MessageBase(object):
             header_value = self.get_header(single_header)
             setattr(self, attr, header_value[0] if header_value else '')
 
+        # The recipient headers are decoded on first access (see the to and
+        # cc properties below), since mailbox listings rarely show them
         self.sender = self.get_header("From")
-        self.to = self.get_header('To')
-        self.cc = self.get_header("Cc")
 
         message_ids = self.get_header('Message-Id')
         if len(message_ids) == 0:
@@ -233,6 +233,22 @@ class MessageBase(object):
         except Exception:
             return ()
 
+    @property
+    def to(self):
+        try:
+            return self._to
+        except AttributeError:
+            self._to = self.get_header('To')
+            return self._to
+
+    @property
+    def cc(self):
+        try:
+            return self._cc
+        except AttributeError:
+            self._cc = self.get_header("Cc")
+            return self._cc
+
     @property
     def from_address(self):
         if not hasattr(self, '_from_address'):
@@ -315,111 +331,10 @@ class MessageBase(object):
         Returns:
             True on success, and in all other instances an error object
         """
-        @pygmail.errors.check_imap_response(callback)
-        def _on_original_mailbox_reselected(imap_response):
-            return _cmd(callback, True)
-
-        @pygmail.errors.check_imap_state(callback)
-        def _on_recevieved_connection_6(connection):
-            return _cmd_cb(connection.select, _on_original_mailbox_reselected,
-                           bool(callback), self.mailbox.name)
-
-        @pygmail.errors.check_imap_response(callback)
-        def _on_expunge_complete(imap_response):
-            return _cmd_cb(self.conn, _on_recevieved_connection_6, bool(callback))
-
-        @pygmail.errors.check_imap_state(callback)
-        def _on_recevieved_connection_5(connection):
-            return _cmd_cb(connection.expunge, _on_expunge_complete, bool(callback))
-
-        @pygmail.errors.check_imap_response(callback)
-        def _on_delete_complete(imap_response):
-            return _cmd_cb(self.conn, _on_recevieved_connection_5, bool(callback))
-
-        @pygmail.errors.check_imap_state(callback)
-        def _on_received_connection_4(connection, deleted_uid):
-            del self.num_tries
-            return _cmd_cb(connection.uid, _on_delete_complete,
-                           bool(callback), 'STORE', deleted_uid,
-                           '+FLAGS', '\\Deleted')
-
-        @pygmail.errors.check_imap_response(callback)
-        def _on_search_for_message_complete(imap_response):
-            data = extract_data(imap_response)
-
-            # Its possible here that we've tried to select the message
-            # we want to delete from the trash bin before google has
-            # registered it there for us.  If our search attempt returned
-            # a uid, then we're good to go and can continue.
-            try:
-                deleted_uid = data[0].split()[-1]
-                cbp = dict(deleted_uid=deleted_uid)
-                return _cmd_cb(self.conn, _on_received_connection_4,
-                               bool(callback), callback_args=cbp)
-
-            # If not though, we should wait a couple of seconds and try
-            # again.  We'll do this a maximum of 5 times.  If we still
-            # haven't had any luck at this point, we give up and return
-            # False, indiciating we weren't able to delete the message
-            # fully.
-            except IndexError:
-                self.num_tries += 1
-
-                # If this is the 5th time we're trying to delete this
-                # message, we're going to call it a loss and stop trying.
-                # We do some minimal clean up and then just bail out
-                # Otherwise, schedule another attempt in 2 seconds and
-                # hope that gmail has updated its indexes by then
-                if self.num_tries == 5:
-                    del self.num_tries
-                    if __debug__:
-                        _log.error(u"Giving up trying to delete message {subject} - {id}".format(subject=self.subject, id=self.message_id))
-                        _log.error("got response: {response}".format(response=str(imap_response)))
-                    return _cmd(callback, False)
-                else:
-                    if __debug__:
-                        _log.error("Try {num} to delete deleting message {subject} - {id} failed.  Waiting".format(num=self.num_tries, subject=self.subject, id=self.message_id))
-                        _log.error("got response: {response}".format(response=str(imap_response)))
-                    return _cmd_in(_on_trash_selected, 2, bool(callback), force_success=True)
-
-        @pygmail.errors.check_imap_state(callback)
-        def _on_received_connection_3(connection):
-            return _cmd_cb(connection.uid, _on_search_for_message_complete,
-                           bool(callback), 'search', None, 'X-GM-RAW',
-                            '"rfc822msgid:{msg_id}"'.format(msg_id=self.message_id))
-
-        def _on_trash_selected(imap_response, force_success=False):
-            # It can take several attempts for the deleted message to show up
-            # in the trash label / folder.  We'll try 5 times, waiting
-            # two sec between each attempt
-            if force_success:
-                return _cmd_cb(self.conn, _on_received_connection_3, bool(callback))
-            else:
-                is_error = check_for_response_error(imap_response)
-                if is_error:
-                    return _cmd(callback, is_error)
-                else:
-                    return _cmd_cb(self.conn, _on_received_connection_3, bool(callback))
-
-        @pygmail.errors.check_imap_state(callback)
-        def _on_received_connection_2(connection):
-            self.num_tries = 0
-            return _cmd_cb(connection.select, _on_trash_selected, bool(callback), trash_folder)
-
-        @pygmail.errors.check_imap_response(callback)
-        def _on_message_moved(imap_response):
-            return _cmd_cb(self.conn, _on_received_connection_2, bool(callback))
-
-        @pygmail.errors.check_imap_state(callback)
-        def _on_received_connection(connection):
-            return _cmd_cb(connection.uid, _on_message_moved, bool(callback),
-                           'COPY', self.uid, trash_folder)
-
-        @pygmail.errors.check_imap_response(callback)
-        def _on_mailbox_select(is_selected):
-            return _cmd_cb(self.conn, _on_received_connection, bool(callback))
-
-        return _cmd_cb(self.mailbox.select, _on_mailbox_select, bool(callback))
+        # The mailbox carries out the whole copy / search / expunge sequence
+        # on a single connection, so there's no need to duplicate it here
+        return self.mailbox.delete_message(self.uid, self.message_id,
+                                           trash_folder, callback=callback)
 
 
 class MessageHeaders(MessageBase):
@@ -437,7 +352,7 @@ class MessageHeaders(MessageBase):
         def _on_teaser_fetched(teaser):
             return _cmd(callback, teaser)
 
-        return _cmd_cb(self.mailbox.fetch, _on_teaser_fetched, bool(callback), self.uid, teaser=True)
+        return _cmd_cb_direct(self.mailbox.fetch, _on_teaser_fetched, bool(callback), self.uid, teaser=True)
 
     def full_message(self, callback=None):
         """Fetches the full version of the message that this message is a teaser
@@ -445,7 +360,7 @@ class MessageHeaders(MessageBase):
         def _on_full_message_fetched(full_msg):
             return _cmd(callback, full_msg)
 
-        return _cmd_cb(self.mailbox.fetch, _on_full_message_fetched, bool(callback), self.uid, full=True)
+        return _cmd_cb_direct(self.mailbox.fetch, _on_full_message_fetched, bool(callback), self.uid, full=True)
 
 
 class MessageTeaser(MessageBase):
@@ -527,7 +442,7 @@ class MessageTeaser(MessageBase):
         def _on_full_msg_fetched(full_msg):
             return _cmd(callback, full_msg)
 
-        return _cmd_cb(self.mailbox.fetch, _on_full_msg_fetched, bool(callback), self.uid, full=True)
+        return _cmd_cb_direct(self.mailbox.fetch, _on_full_msg_fetched, bool(callback), self.uid, full=True)
 
 
 class Message(MessageBase):
@@ -568,8 +483,31 @@ class Message(MessageBase):
         self.body_plain = None
         self.encoding_error = None
 
-        self.raw = email.message_from_string(body)
-        self.charset = self.raw.get_content_charset()
+        # Parsing the whole MIME tree is the most expensive part of building
+        # a message, and isn't needed to read its headers or metadata, so
+        # its put off until the body is first used
+        self._raw_text = body
+
+    def _parse_raw(self):
+        if not hasattr(self, '_raw'):
+            self._raw = email.message_from_string(self._raw_text)
+            # Read before any part is normalized to utf-8, which would
+            # otherwise change the charset the message reports
+            self._charset = self._raw.get_content_charset()
+            del self._raw_text
+
+    @property
+    def raw(self):
+        """The email.message.Message parsed from the full text of the message,
+        which is only parsed the first time its needed"""
+        self._parse_raw()
+        return self._raw
+
+    @property
+    def charset(self):
+        """The charset declared for the message as a whole, if any"""
+        self._parse_raw()
+        return self._charset
 
     def set_header(self, key, value, current_encoding='ascii'):
         """Sets a header, stored as utf-8 unicode
@@ -587,8 +525,10 @@ class Message(MessageBase):
     def _build_body_strings(self):
         if not self.has_built_body_strings:
 
-            self.body_plain = u''
-            self.body_html = u''
+            # Collect the text of each section and join them once at the
+            # end, instead of re-copying the body so far for every section
+            plain_sections = []
+            html_sections = []
 
             for part in typed_subpart_iterator(self.raw, 'text', 'plain'):
                 section_encoding = message_part_charset(part, self.raw) or self.charset
@@ -597,7 +537,7 @@ class Message(MessageBase):
                 if is_encoding_error(section_text):
                     self.encoding_error = section_text
                 else:
-                    self.body_plain += section_text
+                    plain_sections.append(section_text)
 
             for part in typed_subpart_iterator(self.raw, 'text', 'html'):
                 section_encoding = message_part_charset(part, self.raw) or self.charset
@@ -606,7 +546,10 @@ class Message(MessageBase):
                 if is_encoding_error(section_text):
                     self.encoding_error = section_text
                 else:
-                    self.body_html += section_text
+                    html_sections.append(section_text)
+
+            self.body_plain = u''.join(plain_sections)
+            self.body_html = u''.join(html_sections)
 
             self.has_built_body_strings = True
 
@@ -726,7 +669,10 @@ class Message(MessageBase):
         def _on_append(imap_response):
             data = extract_data(imap_response)
             self.uid = data[0].split()[2][:-1]
-            return _cmd_cb(self.conn, _on_post_append_connection, bool(callback))
+            # The mailbox just grew by a message, so its cached count (and
+            # cached messages) are now out of date
+            self.mailbox.invalidate()
+            return _cmd_cb_direct(self.conn, _on_post_append_connection, bool(callback))
 
         @pygmail.errors.check_imap_state(callback)
         def _on_received_connection(connection):
@@ -736,19 +682,16 @@ class Message(MessageBase):
                            self.internal_date or time.gmtime(),
                            self.raw.as_string())
 
-        @pygmail.errors.check_imap_response(callback)
-        def _on_select(is_selected):
-            return _cmd_cb(self.conn, _on_received_connection, bool(callback))
-
         @pygmail.errors.check_imap_response(callback)
         def _on_delete(was_deleted):
-            return _cmd_cb(self.mailbox.select, _on_select, bool(callback))
+            return self.mailbox._ensure_selected(_on_received_connection,
+                                                 callback)
 
         # If we're not using the safe / transactional method of creating
         # a copy before we delete the existing version, we can just skip
         # ahead to the delete action. Otherwise, we need to first create
         # a safe version of this message.
-        return _cmd_cb(self.delete, _on_delete, bool(callback), trash_folder)
+        return _cmd_cb_direct(self.delete, _on_delete, bool(callback), trash_folder)
 
     def remove_attachment(self, attachment):
         """Removes a given attachment from the message body. This method
@@ -880,7 +823,7 @@ class Message(MessageBase):
         def _on_save(was_success):
             return _cmd(callback, was_success)
 
-        return _cmd_cb(self.save, _on_save, bool(callback), trash_folder)
+        return _cmd_cb_direct(self.save, _on_save, bool(callback), trash_folder)
 
     def save_copy(self, safe_label, header_label="PyGmail", callback=None):
         """Saves a semi-identical copy of the message in another label / mailbox
@@ -924,9 +867,11 @@ class Message(MessageBase):
         def _on_safe_save_append(imap_response, message_copy):
             data = extract_data(imap_response)
             msg_uid = data[0].split()[2][:-1]
+            # As in save(), the copy makes the mailbox's cached count stale
+            self.mailbox.invalidate()
             cbp = dict(message_uid=msg_uid, message_id=message_copy['Message-Id'])
-            return _cmd_cb(self.conn, _post_safe_save_connection, bool(callback),
-                           callback_args=cbp)
+            return _cmd_cb_direct(self.conn, _post_safe_save_connection, bool(callback),
+                                  callback_args=cbp)
 
         @pygmail.errors.check_imap_state(callback)
         def _on_safe_save_connection(connection, message_copy):
@@ -940,10 +885,10 @@ class Message(MessageBase):
         @pygmail.errors.check_imap_response(callback)
         def _on_safe_save_message(message_copy):
             cbp = dict(message_copy=message_copy)
-            return _cmd_cb(self.conn, _on_safe_save_connection, bool(callback),
-                           callback_args=cbp)
+            return _cmd_cb_direct(self.conn, _on_safe_save_connection, bool(callback),
+                                  callback_args=cbp)
 
-        return _cmd_cb(self.safe_save_message, _on_safe_save_message, bool(callback))
+        return _cmd_cb_direct(self.safe_save_message, _on_safe_save_message, bool(callback))
 
     def safe_save_message(self, header_label="PyGmail", callback=None):
         """Create a text version of the message that is similar to, but not
@@ -72,7 +72,7 @@ def schedule_func(func, secs=None):
         io_loop.add_callback(func)
 
 
-def _log(msg, log_name="tornado.application"):
+def _log(msg, log_name="tornado.application", level=logging.ERROR):
     """Simple point of indirection to handle all logging code in one place,
     to further lessen dependence on Tornado
 
@@ -81,8 +81,9 @@ def _log(msg, log_name="tornado.application"):
 
     Keyword Args:
         log_name -- the name of the system logger to send messages to
+        level    -- the logging level to record the message at
     """
-    logging.getLogger(log_name).error(msg)
+    logging.getLogger(log_name).log(level, msg)
 
 
 def _cmd_in(func, secs, is_async, *args, **kwargs):
@@ -183,6 +184,45 @@ def _cmd_cb(main_func, callback, is_async, *args, **kwargs):
             return callback(rs)
 
 
+def _cmd_cb_direct(main_func, callback, is_async, *args, **kwargs):
+    """Same as _cmd_cb, except that when called asyncronously, the callback
+    is handed to the main function as is, instead of being wrapped so that
+    it is rescheduled on the event loop.
+
+    This saves a trip through the event loop, and so should only be used when
+    the main function already calls its callback from the event loop (ie
+    most pygmail methods that take a callback).  Raw imaplib2 commands call
+    their callbacks from imaplib2's handler thread, so they should always go
+    through _cmd_cb instead.
+
+    Args:
+        main_func   -- the main function that should be called
+        callback    -- the function that should receive the result of the
+                       func function
+        is_async    -- truth-y value, describing whether the function should
+                       be called asyncronously (in the event loop) or
+                       syncronously / blocking
+
+    Keyword Args:
+        callback_args -- a dictionary of values that should be passed as the
+                         second argument to the callback function
+
+    Returns:
+        If being called asyncronously, nothing is returned.  If called
+        syncronously, the result of the "func" function is returned
+    """
+    if not is_async:
+        return _cmd_cb(main_func, callback, is_async, *args, **kwargs)
+
+    if "callback_args" in kwargs:
+        callback_args = kwargs['callback_args']
+        del kwargs['callback_args']
+        kwargs['callback'] = lambda res: callback(res, **callback_args)
+    else:
+        kwargs['callback'] = callback
+    main_func(*args, **kwargs)
+
+
 ### Parsing Utilities, "adapted" from
 ### http://pydoc.net/Python/gocept.imapapi/0.5/gocept.imapapi.parser/
 
@@ -194,7 +234,10 @@ def iterate_pairs(iterable):
         yield iterable.next(), iterable.next()
 
 
-ATOM_CHARS = [chr(i) for i in xrange(32, 256) if chr(i) not in r'(){%*"\ ]']
+# Looked up once or more for every character the parser reads, so kept as a
+# set rather than scanning a list of ~200 characters each time
+ATOM_CHARS = frozenset(chr(i) for i in xrange(32, 256)
+                       if chr(i) not in r'(){%*"\ ]')
 
 
 class ParseError(Exception):
@@ -395,16 +438,33 @@ def read_quoted(data):
 
     """
     assert data.next() == '"'
-    result = ''
+    # Characters are collected in a list and joined once at the end, instead
+    # of building a new string for every character read
+    result = []
     for c in data:
         if c == '"':
             break
         if c == '\\' and data.ahead in ('"', '\\'):
             c = data.next()
-        result += c
+        result.append(c)
     else:
         raise ParseError('Unexpected end of quoted string', data)
-    return result
+    return ''.join(result)
+
+
+def quote(value):
+    r"""Quote a string for use as an argument in an IMAP command, escaping
+    any backslashes and double quotes it contains.  This is the inverse of
+    read_quoted.
+
+    >>> quote('asdf')
+    '"asdf"'
+
+    >>> quote('a"s\\df')
+    '"a\\"s\\\\df"'
+
+    """
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
 
 
 def read_literal(data):
@@ -421,16 +481,16 @@ def read_literal(data):
 
     """
     assert data.next() == '{'
-    count = ''
+    count = []
     for c in data:
         if c == '}':
             break
-        count += c
+        count.append(c)
     if not (data.ahead and data.next() == '\r' and
             data.ahead and data.next() == '\n'):
         raise ParseError('Syntax error in literal string', data)
     try:
-        count = int(count)
+        count = int(''.join(count))
     except ValueError:
         raise ParseError(
             'Non-integer token for length of literal string', data)
@@ -490,15 +550,17 @@ def read_atom(data):
 
     """
     assert data.ahead in ATOM_CHARS
-    result = ''
+    chars = []
     while data.ahead in ATOM_CHARS:
         c = data.next()
         if c == '[':
             break
         else:
-            result += c
+            chars.append(c)
     else:
-        return Atom(result)
+        return Atom(''.join(chars))
+
+    result = ''.join(chars)
 
     if data.ahead == ']':
         msgtext = ''